@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Offline micro-benchmarks for the journal build stage.
+
+Generates synthetic JournalEntries.csv files and reference tables, then times
+load_journal_entries, _shared_line_location and build_location_routing and
+records peak / retained memory with tracemalloc. No Intacct calls are made.
+
+    python benchmarks/build_stage.py --lines 1000 100000 --customers 1000
+    python benchmarks/build_stage.py --save-baseline baseline.json
+    python benchmarks/build_stage.py --compare baseline.json --threshold 0.2 --memory-threshold 0.1
+"""
+import argparse
+import csv
+import json
+import logging
+import math
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import singer
+
+from target_intacct import _shared_line_location, build_location_routing, load_journal_entries
+
+LINE_SCALES = [1_000, 100_000, 1_000_000]
+CUSTOMER_SCALES = [1_000, 100_000]
+
+REFERENCE_SIZES = {
+    'accounts': 500,
+    'classes': 50,
+    'entities': 10,
+    'locations_per_entity': 10,
+    'departments': 50,
+    'items': 500,
+    'projects': 200,
+}
+
+# Project is a UDD whose values are looked up; Memo is a free text field.
+CUSTOM_FIELDS = [
+    {'input_id': 'Project', 'intacct_id': 'project'},
+    {'input_id': 'Memo', 'intacct_id': 'memo'},
+]
+
+FREE_TEXT_FIELDS = {'MEMO'}
+
+# Stats compared against a baseline, and which --*threshold option applies.
+COMPARED_STATS = {'seconds': 'threshold', 'peak_bytes': 'memory_threshold', 'retained_blocks': 'memory_threshold'}
+
+
+class OfflineClient:
+    """Stands in for SageIntacctSDK; UDD values resolve like a match, free text fields are not objects."""
+
+    def get_dimension(self, intacct_object):
+        if intacct_object.upper() in FREE_TEXT_FIELDS:
+            return {'udd': False, 'key_field': None}
+        return {'udd': True, 'key_field': 'id'}
+
+    def get_match(self, intacct_object, query):
+        return {'id': query.split("'")[1]}
+
+
+def generate_references(customers):
+    entities = [
+        {'LOCATIONID': f'E{e}', 'NAME': f'Entity {e}', 'ENTITY': f'E{e}'}
+        for e in range(REFERENCE_SIZES['entities'])
+    ]
+    children = [
+        {'LOCATIONID': f'E{e}-L{n}', 'NAME': f'Location {e}-{n}', 'ENTITY': f'E{e}'}
+        for e in range(REFERENCE_SIZES['entities'])
+        for n in range(REFERENCE_SIZES['locations_per_entity'])
+    ]
+    return {
+        'accounts': [
+            {'RECORDNO': str(n), 'ACCOUNTNO': str(1000 + n), 'TITLE': f'Account {n}'}
+            for n in range(REFERENCE_SIZES['accounts'])
+        ],
+        'classes': [
+            {'RECORDNO': str(n), 'CLASSID': f'C{n}', 'NAME': f'Class {n}'}
+            for n in range(REFERENCE_SIZES['classes'])
+        ],
+        'customers': [{'CUSTOMERID': f'CUST{n}', 'NAME': f'Customer {n}'} for n in range(customers)],
+        'locations': entities + children,
+        'departments': [
+            {'DEPARTMENTID': f'D{n}', 'TITLE': f'Department {n}'}
+            for n in range(REFERENCE_SIZES['departments'])
+        ],
+        'items': [{'ITEMID': f'I{n}', 'NAME': f'Item {n}'} for n in range(REFERENCE_SIZES['items'])],
+    }
+
+
+def generate_journal_csv(path, lines, references, custom_fields, seed=0):
+    """Writes balanced journals of 2-10 lines; most journals share one location."""
+    rng = random.Random(seed)
+    columns = [
+        'Transaction Date', 'Journal Entry Id', 'Class', 'Account Number', 'Account Name',
+        'Posting Type', 'Description', 'Amount', 'Location', 'Department', 'Customer Name', 'Item',
+    ]
+    if custom_fields:
+        columns.extend(field['input_id'] for field in CUSTOM_FIELDS)
+
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        written = 0
+        journal = 0
+        while written < lines:
+            size = min(rng.randint(1, 5) * 2, lines - written)
+            shared = rng.choice(references['locations'])['NAME'] if rng.random() < 0.8 else None
+            amount = round(rng.uniform(1, 10_000), 2)
+            for n in range(size):
+                account = rng.choice(references['accounts'])
+                row = [
+                    '01/31/2024',
+                    f'JE-{journal}',
+                    rng.choice(references['classes'])['NAME'],
+                    account['ACCOUNTNO'],
+                    account['TITLE'],
+                    'Debit' if n % 2 == 0 else 'Credit',
+                    f'Line {n} of journal {journal}',
+                    amount,
+                    shared or rng.choice(references['locations'])['NAME'],
+                    rng.choice(references['departments'])['TITLE'],
+                    rng.choice(references['customers'])['NAME'],
+                    rng.choice(references['items'])['NAME'],
+                ]
+                if custom_fields:
+                    row.append(f"Project {rng.randrange(REFERENCE_SIZES['projects'])}")
+                    row.append(f"Memo {journal}-{n}")
+                writer.writerow(row)
+            written += size
+            journal += 1
+
+
+def measure(func, memory=True):
+    """Returns (result, stats) with wall time and, optionally, tracemalloc figures."""
+    start = time.perf_counter()
+    result = func()
+    stats = {'seconds': time.perf_counter() - start}
+
+    if memory:
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        func()
+        after = tracemalloc.take_snapshot()
+        stats['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        diff = after.compare_to(before, 'filename')
+        stats['retained_bytes'] = sum(stat.size_diff for stat in diff)
+        stats['retained_blocks'] = sum(stat.count_diff for stat in diff)
+
+    return result, stats
+
+
+def run_case(lines, customers, custom_fields, memory=True, build_processes=1):
+    references = generate_references(customers)
+    with tempfile.TemporaryDirectory() as input_path:
+        generate_journal_csv(Path(input_path) / 'JournalEntries.csv', lines, references, custom_fields)
+        config = {
+            'input_path': input_path,
+            'custom_fields': CUSTOM_FIELDS if custom_fields else [],
+            'build_processes': build_processes,
+        }
+
+        journal_entries, build = measure(
+            lambda: load_journal_entries(
+                OfflineClient(), config, references['accounts'], references['classes'],
+                references['customers'], references['locations'], references['departments'],
+                references['items'],
+            ),
+            memory,
+        )
+
+    _, shared_stats = measure(
+        lambda: [_shared_line_location(je['ENTRIES']['GLENTRY']) for je in journal_entries], memory
+    )
+    _, routing_stats = measure(lambda: build_location_routing(references['locations']), memory)
+
+    return {
+        'load_journal_entries': build,
+        '_shared_line_location': shared_stats,
+        'build_location_routing': routing_stats,
+    }
+
+
+def case_name(lines, customers, custom_fields):
+    return f"lines={lines} customers={customers} custom_fields={'on' if custom_fields else 'off'}"
+
+
+def _change(new, base):
+    if base > 0:
+        return new / base - 1
+    return 0.0 if new <= base else math.inf
+
+
+def compare(results, baseline, thresholds):
+    """
+    Prints stage timings and memory against the baseline; returns True if any
+    stat grew by more than its threshold in `thresholds` (keyed like COMPARED_STATS).
+    """
+    regressed = False
+    for case, stages in results.items():
+        for stage, stats in stages.items():
+            base = baseline.get(case, {}).get(stage)
+            if not base:
+                continue
+            for stat, threshold in COMPARED_STATS.items():
+                if stat not in stats or stat not in base:
+                    continue
+                change = _change(stats[stat], base[stat])
+                flag = 'REGRESSION' if change > thresholds[threshold] else ''
+                regressed = regressed or bool(flag)
+                if stat == 'seconds':
+                    values = f"{base[stat]:.3f}s -> {stats[stat]:.3f}s"
+                else:
+                    values = f"{base[stat]} -> {stats[stat]}"
+                print(f"{case} {stage} {stat}: {values} ({change:+.0%}) {flag}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--lines', type=int, nargs='+', default=LINE_SCALES[:1])
+    parser.add_argument('--customers', type=int, nargs='+', default=CUSTOMER_SCALES[:1])
+    parser.add_argument('--custom-fields', choices=['on', 'off', 'both'], default='both')
+    parser.add_argument('--build-processes', type=int, default=1, help='Passed as config build_processes')
+    parser.add_argument('--no-memory', action='store_true', help='Skip the tracemalloc pass')
+    parser.add_argument('--save-baseline', help='Write results to this JSON file')
+    parser.add_argument('--compare', help='Compare against a saved baseline JSON file')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Allowed slowdown before flagging')
+    parser.add_argument(
+        '--memory-threshold', type=float, default=0.2,
+        help='Allowed growth of peak_bytes and retained_blocks before flagging',
+    )
+    args = parser.parse_args()
+
+    # Per-journal "Converting ..." logging would dominate the timings.
+    singer.get_logger().setLevel(logging.ERROR)
+
+    custom_field_modes = {'on': [True], 'off': [False], 'both': [False, True]}[args.custom_fields]
+    results = {}
+    for lines in args.lines:
+        for customers in args.customers:
+            for custom_fields in custom_field_modes:
+                name = case_name(lines, customers, custom_fields)
+                results[name] = run_case(
+                    lines, customers, custom_fields, memory=not args.no_memory, build_processes=args.build_processes
+                )
+                for stage, stats in results[name].items():
+                    print(f"{name} {stage}: " + ', '.join(f'{k}={v:.3f}' if isinstance(v, float) else f'{k}={v}'
+                                                         for k, v in stats.items()))
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        thresholds = {'threshold': args.threshold, 'memory_threshold': args.memory_threshold}
+        if compare(results, baseline, thresholds):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,37 @@
 #!/usr/bin/env python3
 import datetime as dt
 import json
+import logging
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Dict, FrozenSet, Optional
+from typing import Dict, FrozenSet, List, Optional
 
 import math
 import pandas as pd
+import requests
 
 import singer
 from singer import metadata
 
-from target_intacct.client import SageIntacctSDK, get_client
+from target_intacct.budget import estimate_api_calls, get_api_budget
+from target_intacct.client import (
+    DEFAULT_CONNECT_TIMEOUT,
+    DEFAULT_READ_TIMEOUT,
+    Deadline,
+    SageIntacctSDK,
+    get_client,
+)
 from target_intacct.const import DEFAULT_API_URL, KEY_PROPERTIES, REQUIRED_CONFIG_KEYS
+from target_intacct.exceptions import (
+    ApiQuotaExceededError,
+    DeadlineExceededError,
+    ExpiredTokenError,
+    InternalServerError,
+    InvalidTokenError,
+    RetryableIntacctError,
+    SageIntacctSDKError,
+)
 
 logger = singer.get_logger()
 
@@ -21,6 +40,25 @@ class DependencyException(Exception):
     pass
 
 
+# Errors worth another attempt at the end of a continue_on_error run, when creates are
+# idempotent. Anything else raised by the SDK (bad params, privileges, not found) is
+# permanent for that journal.
+TRANSIENT_ERRORS = (
+    RetryableIntacctError,
+    InternalServerError,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+)
+
+# Errors that stop a continue_on_error run: every remaining journal would fail the same way.
+RUN_STOP_ERRORS = (
+    DeadlineExceededError,
+    ApiQuotaExceededError,
+    InvalidTokenError,
+    ExpiredTokenError,
+)
+
+
 def _get_abs_path(path: str) -> Path:
     p = Path(__file__).parent / path
     return p.resolve()
@@ -40,162 +78,340 @@ def _get_start(key: str) -> dt.datetime:
 
 def _shared_line_location(lines):
     """Return LOCATION when every line has the same non-empty value, else None."""
-    locs = [line.get('LOCATION') for line in lines]
-    if not locs or any(loc is None for loc in locs):
-        return None
-    unique = set(locs)
-    return unique.pop() if len(unique) == 1 else None
-
-
-def _entity_location_id(location_id, locations):
-    """Map a location (including child locations) to a login-capable entity id."""
-    loc = next((x for x in locations if x.get('LOCATIONID') == str(location_id)), None)
-    if not loc:
-        return location_id
-    # Child locations cannot be used in <locationid>; login as their parent entity.
-    entity = loc.get('ENTITY')
-    if entity and str(entity) != str(location_id):
-        return entity
-    return location_id
-
-
-def load_journal_entries(client, config, accounts, classes, customers, locations, departments, items):
-    # Get input path
-    input_path = f"{config['input_path']}/JournalEntries.csv"
-    # Read the passed CSV
-    df = pd.read_csv(input_path)
-    # Verify it has required columns
-    cols = list(df.columns)
-    REQUIRED_COLS = ["Transaction Date", "Journal Entry Id", "Class", "Account Number", "Account Name", "Posting Type", "Description"]
+    shared = None
+    for line in lines:
+        loc = line.get('LOCATION')
+        if loc is None or (shared is not None and loc != shared):
+            return None
+        shared = loc
+    return shared
 
-    if not all(col in cols for col in REQUIRED_COLS):
-        logger.error(f"CSV is missing REQUIRED_COLS. Found={json.dumps(cols)}, Required={json.dumps(REQUIRED_COLS)}")
-        sys.exit(1)
 
-    journal_entries = []
-    errored = False
-
-    def build_lines(x):
-        # Get the journal entry id
-        je_id = x['Journal Entry Id'].iloc[0]
-        logger.info(f"Converting {je_id}...")
-        line_items = []
-
-        # Create line items
-        for index, row in x.iterrows():
-            # Create journal entry line detail
-            je_detail = {
-                "DESCRIPTION": row['Description'],
-                "TRX_AMOUNT": str(round(row['Amount'], 2)),
-                "TR_TYPE": 1 if row['Posting Type'].upper() == "DEBIT" else -1
+def build_location_routing(locations):
+    """
+    Map every LOCATIONID to the login-capable entity it posts under.
+
+    Child locations cannot be used in <locationid>, so each one follows its ENTITY
+    links up to a location that is its own entity (or has none). Built once per
+    run; a location missing from the table is its own entity.
+    """
+    parents = {
+        str(loc['LOCATIONID']): str(loc['ENTITY']) if loc.get('ENTITY') else None
+        for loc in locations
+    }
+    routing = {}
+    for location_id in parents:
+        chain = []
+        current = location_id
+        while current not in routing:
+            parent = parents.get(current)
+            if not parent or parent == current or parent in chain:
+                routing[current] = current
+                break
+            chain.append(current)
+            current = parent
+        for loc in chain:
+            routing[loc] = routing[current]
+    return routing
+
+
+def _journal_payload(je):
+    """The GLBATCH fields of a built journal, without routing keys such as _ENTITY."""
+    return {key: value for key, value in je.items() if not key.startswith('_')}
+
+
+def _write_dead_letter(path, failed, not_attempted=(), stop=None) -> None:
+    """
+    Write journals that could not be posted, one JSON object per line, with their
+    error. Journals left unposted when the run stopped get status 'not_attempted'
+    and the error that stopped it.
+    """
+    with open(path, 'w') as f:
+        records = [(je, exc, 'failed') for je, exc in failed]
+        records += [(je, stop, 'not_attempted') for je in not_attempted]
+        for je, exc, status in records:
+            record = {
+                'journal': _journal_payload(je),
+                'status': status,
+                'error_type': type(exc).__name__,
+                'error': getattr(exc, 'response', None) or str(exc),
             }
+            f.write(json.dumps(record, default=str) + '\n')
+    logger.info(f"Wrote {len(failed)} failed and {len(not_attempted)} unattempted journals to {path}")
 
-            # Get the Account Ref
-            acct_num = str(int(row['Account Number'])) if row['Account Number'] is not None and not math.isnan(row['Account Number']) else None
-            acct_name = row['Account Name']
-            acct_ref = acct_num if acct_num is not None else next((x['ACCOUNTNO'] for x in accounts if x['TITLE'] == acct_name), None)
 
-            if acct_ref is not None:
-                je_detail["ACCOUNTNO"] = acct_ref
-            else:
-                errored = True
-                logger.error(f"Account is missing on Journal Entry {je_id}! Name={acct_name} No={acct_num}")
+def _build_journal_entry(x, config, references, resolve_dimension):
+    """
+    Convert the CSV rows of one Journal Entry Id into a GLBATCH.
+    A line without an account is logged and left without ACCOUNTNO.
+    """
+    accounts = references['accounts']
+    classes = references['classes']
+    customers = references['customers']
+    locations = references['locations']
+    departments = references['departments']
+    items = references['items']
+    dimensions = references['dimensions']
+    routing = references['routing']
+    custom_fields = config.get("custom_fields") or []
+
+    # Get the journal entry id
+    je_id = x['Journal Entry Id'].iloc[0]
+    logger.info(f"Converting {je_id}...")
+    line_items = []
+
+    # Create line items
+    for index, row in x.iterrows():
+        # Create journal entry line detail
+        je_detail = {
+            "DESCRIPTION": row['Description'],
+            "TRX_AMOUNT": str(round(row['Amount'], 2)),
+            "TR_TYPE": 1 if row['Posting Type'].upper() == "DEBIT" else -1
+        }
 
-            # Get the Class Ref
-            class_name = row['Class']
-            class_ref = next((x['CLASSID'] for x in classes if x['NAME'] == class_name), None)
+        # Get the Account Ref
+        acct_num = str(int(row['Account Number'])) if row['Account Number'] is not None and not math.isnan(row['Account Number']) else None
+        acct_name = row['Account Name']
+        acct_ref = acct_num if acct_num is not None else next((x['ACCOUNTNO'] for x in accounts if x['TITLE'] == acct_name), None)
 
-            if class_ref is not None:
-                je_detail["CLASSID"] = class_ref
-            else:
-                logger.warning(f"Class is missing on Journal Entry {je_id}! Name={class_name}")
+        if acct_ref is not None:
+            je_detail["ACCOUNTNO"] = acct_ref
+        else:
+            logger.error(f"Account is missing on Journal Entry {je_id}! Name={acct_name} No={acct_num}")
 
-            # Get the Location Ref if Location column exist
-            if 'Location' in row.index:
-                location_name = row['Location']
-                location_ref = next((x['LOCATIONID'] for x in locations if x['NAME'] == location_name), None)
+        # Get the Class Ref
+        class_name = row['Class']
+        class_ref = next((x['CLASSID'] for x in classes if x['NAME'] == class_name), None)
 
-                if location_ref is not None:
-                    je_detail["LOCATION"] = location_ref
-                else:
-                    logger.warning(f"Location is missing on Journal Entry {je_id}! Name={location_name}")
+        if class_ref is not None:
+            je_detail["CLASSID"] = class_ref
+        else:
+            logger.warning(f"Class is missing on Journal Entry {je_id}! Name={class_name}")
 
-            # Get the Department Ref if Department column exist
-            if 'Department' in row.index:
-                department_name = row['Department']
-                department_ref = next((x['DEPARTMENTID'] for x in departments if x['TITLE'] == department_name), None)
+        # Get the Location Ref if Location column exist
+        if 'Location' in row.index:
+            location_name = row['Location']
+            location_ref = next((x['LOCATIONID'] for x in locations if x['NAME'] == location_name), None)
 
-                if department_ref is not None:
-                    je_detail["DEPARTMENT"] = department_ref
-                else:
-                    logger.warning(f"Department is missing on Journal Entry {je_id}! Name={department_name}")
+            if location_ref is not None:
+                je_detail["LOCATION"] = location_ref
+            else:
+                logger.warning(f"Location is missing on Journal Entry {je_id}! Name={location_name}")
 
-            # Get the Quickbooks Customer
-            if 'Customer ID' in row.index:
-                customer_id = row['Customer ID']
-                if customer_id is not None:
-                    je_detail["CUSTOMERID"] = customer_id
-                else:
-                    logger.warning(f"Customer ID is missing on Journal Entry {je_id}! Name={customer_id}")
-            elif 'Customer Name' in row.index:
-                customer_name = row['Customer Name']
-                customer_ref = next((x['CUSTOMERID'] for x in customers if x['NAME'] == customer_name), None)
-                if customer_ref is not None:
-                    je_detail["CUSTOMERID"] = customer_ref
-                else:
-                    logger.warning(f"Customer is missing on Journal Entry {je_id}! Name={customer_name}")
-
-            # Append the currency if provided
-            if row.get('Currency') is not None:
-                je_detail['CURRENCY'] = row['Currency']
-            
-            # Append item if provided
-            if row.get('Item ID') is not None:
-                je_detail['ITEMID'] = row['Item ID']
-            elif "Item" in row.index:
-                item = row['Item']
-                item_ref = next((x['ITEMID'] for x in items if x['NAME'] == item), None)
-                if item_ref is not None:
-                    je_detail["ITEMID"] = item_ref
+        # Get the Department Ref if Department column exist
+        if 'Department' in row.index:
+            department_name = row['Department']
+            department_ref = next((x['DEPARTMENTID'] for x in departments if x['TITLE'] == department_name), None)
+
+            if department_ref is not None:
+                je_detail["DEPARTMENT"] = department_ref
+            else:
+                logger.warning(f"Department is missing on Journal Entry {je_id}! Name={department_name}")
+
+        # Get the Quickbooks Customer
+        if 'Customer ID' in row.index:
+            customer_id = row['Customer ID']
+            if customer_id is not None:
+                je_detail["CUSTOMERID"] = customer_id
+            else:
+                logger.warning(f"Customer ID is missing on Journal Entry {je_id}! Name={customer_id}")
+        elif 'Customer Name' in row.index:
+            customer_name = row['Customer Name']
+            customer_ref = next((x['CUSTOMERID'] for x in customers if x['NAME'] == customer_name), None)
+            if customer_ref is not None:
+                je_detail["CUSTOMERID"] = customer_ref
+            else:
+                logger.warning(f"Customer is missing on Journal Entry {je_id}! Name={customer_name}")
+
+        # Append the currency if provided
+        if row.get('Currency') is not None:
+            je_detail['CURRENCY'] = row['Currency']
+
+        # Append item if provided
+        if row.get('Item ID') is not None:
+            je_detail['ITEMID'] = row['Item ID']
+        elif "Item" in row.index:
+            item = row['Item']
+            item_ref = next((x['ITEMID'] for x in items if x['NAME'] == item), None)
+            if item_ref is not None:
+                je_detail["ITEMID"] = item_ref
+            else:
+                logger.warning(f"Item is missing on Journal Entry {je_id}! Name={item}")
+
+
+        # Support dynamic custom fields on Journal Entry Line level
+        for ce in custom_fields:
+            value = row.get(ce.get("input_id"))
+            # NOTE: For a UDD we need to append GLDIM here
+            intacct_id = ce.get("intacct_id").upper()
+            if not pd.isna(value):
+                real_value = resolve_dimension(intacct_id, value) if dimensions[intacct_id]['udd'] else None
+                if real_value is not None:
+                    je_detail["GLDIM" + intacct_id] = real_value
                 else:
-                    logger.warning(f"Item is missing on Journal Entry {je_id}! Name={item}")
-
-
-            # Support dynamic custom fields on Journal Entry Line level
-            custom_fields = config.get("custom_fields") or []
-
-            for ce in custom_fields:
-                value = row.get(ce.get("input_id"))
-                # NOTE: For a UDD we need to append GLDIM here
-                intacct_id = ce.get("intacct_id").upper()
-                if not pd.isna(value):
-                    try:
-                        real_value = client.get_match(intacct_id, f"NAME = '{value}'")['id']
-                        je_detail["GLDIM" + intacct_id] = real_value
-                    except:
-                        logger.warning(f"Failed to get a match for {intacct_id} where NAME = '{value}'. Assuming free text input.")
-                        je_detail[intacct_id] = value
-
-            # Create the line item
-            line_items.append(je_detail)
-
-        # Create the entry
-        entry = {
-            'JOURNAL': row.get('Journal', 'APJ'),
-            'BATCH_DATE': row['Transaction Date'],
-            'BATCH_TITLE': je_id,
-            'ENTRIES': {
-                'GLENTRY': line_items
-            }
+                    je_detail[intacct_id] = value
+
+        # Create the line item
+        line_items.append(je_detail)
+
+    # Create the entry
+    entry = {
+        'JOURNAL': row.get('Journal', 'APJ'),
+        'BATCH_DATE': row['Transaction Date'],
+        'BATCH_TITLE': je_id,
+        'ENTRIES': {
+            'GLENTRY': line_items
         }
+    }
+
+    # Entity to log in to when every line shares a location; None posts at top-level.
+    shared = _shared_line_location(line_items)
+    entry['_ENTITY'] = routing.get(str(shared), shared) if shared else None
+
+    return entry
+
 
-        journal_entries.append(entry)
+class _LogCollector(logging.Handler):
+    """Keeps log records in a build worker so the parent can emit them in order."""
 
-    # Build the entries
-    df.groupby("Journal Entry Id").apply(build_lines)
+    def __init__(self):
+        super().__init__()
+        self.records = []
 
-    if errored:
-        raise Exception("Building QBO JournalEntries failed!")
+    def emit(self, record):
+        self.records.append(record)
+
+
+_build_worker_state = {}
+
+
+def _init_build_worker(config, references, resolved_dimensions):
+    """Process pool initializer: receive the reference data once per worker."""
+    collector = _LogCollector()
+    logger.handlers = [collector]
+    _build_worker_state.update(
+        config=config,
+        references=references,
+        resolved_dimensions=resolved_dimensions,
+        collector=collector,
+    )
+
+
+def _build_partition(frame):
+    """Build every journal in `frame` inside a worker. Returns (entries, log records)."""
+    state = _build_worker_state
+    collector = state['collector']
+    collector.records = []
+    resolved_dimensions = state['resolved_dimensions']
+
+    def resolve_dimension(intacct_id, value):
+        return resolved_dimensions.get((intacct_id, value))
+
+    entries = [
+        _build_journal_entry(x, state['config'], state['references'], resolve_dimension)
+        for _, x in frame.groupby("Journal Entry Id")
+    ]
+
+    return entries, collector.records
+
+
+def _build_parallel(df, config, references, resolved_dimensions, processes):
+    """
+    Build journals in a process pool. Journal Entry Ids are split into contiguous
+    partitions so the merged result keeps the serial (sorted id) order.
+    """
+    je_ids = sorted(df["Journal Entry Id"].dropna().unique())
+    partition_count = min(len(je_ids), processes * 4) or 1
+    size = math.ceil(len(je_ids) / partition_count)
+    partitions = [
+        df[df["Journal Entry Id"].isin(je_ids[i:i + size])]
+        for i in range(0, len(je_ids), size)
+    ]
+
+    logger.info(f"Building {len(je_ids)} journal entries in {processes} processes")
+    journal_entries = []
+    with ProcessPoolExecutor(
+        max_workers=processes,
+        initializer=_init_build_worker,
+        initargs=(config, references, resolved_dimensions),
+    ) as pool:
+        for entries, records in pool.map(_build_partition, partitions):
+            for record in records:
+                logger.handle(record)
+            journal_entries.extend(entries)
+
+    return journal_entries
+
+
+def read_journal_entries(config):
+    # Get input path
+    input_path = f"{config['input_path']}/JournalEntries.csv"
+    # Read the passed CSV
+    df = pd.read_csv(input_path)
+    # Verify it has required columns
+    cols = list(df.columns)
+    REQUIRED_COLS = ["Transaction Date", "Journal Entry Id", "Class", "Account Number", "Account Name", "Posting Type", "Description"]
+
+    if not all(col in cols for col in REQUIRED_COLS):
+        logger.error(f"CSV is missing REQUIRED_COLS. Found={json.dumps(cols)}, Required={json.dumps(REQUIRED_COLS)}")
+        sys.exit(1)
+
+    return df
+
+
+def load_journal_entries(client, config, accounts, classes, customers, locations, departments, items, df=None):
+    # The CSV may already have been read (and validated) by upload()
+    if df is None:
+        df = read_journal_entries(config)
+
+    # Discover once whether each custom field is a UDD (resolve values) or free text.
+    custom_fields = config.get("custom_fields") or []
+    dimensions = {}
+    for ce in custom_fields:
+        intacct_id = ce.get("intacct_id").upper()
+        dimensions[intacct_id] = client.get_dimension(intacct_id)
+    resolved_dimensions = {}
+
+    def resolve_dimension(intacct_id, value):
+        key = (intacct_id, value)
+        if key not in resolved_dimensions:
+            try:
+                match = client.get_match(intacct_id, f"NAME = '{value}'")
+                if isinstance(match, list):
+                    match = match[0]
+                resolved_dimensions[key] = match[dimensions[intacct_id]['key_field']]
+            except Exception:
+                logger.warning(f"Failed to get a match for {intacct_id} where NAME = '{value}'. Assuming free text input.")
+                resolved_dimensions[key] = None
+        return resolved_dimensions[key]
+
+    references = {
+        'accounts': accounts,
+        'classes': classes,
+        'customers': customers,
+        'locations': locations,
+        'departments': departments,
+        'items': items,
+        'dimensions': dimensions,
+        'routing': build_location_routing(locations),
+    }
+
+    # build_processes > 1 builds journals in a process pool, split by Journal Entry Id.
+    processes = int(config.get('build_processes') or 1)
+
+    if processes > 1:
+        # Workers have no client, so resolve every UDD value here first.
+        for ce in custom_fields:
+            intacct_id = ce.get("intacct_id").upper()
+            if dimensions[intacct_id]['udd'] and ce.get("input_id") in df.columns:
+                for value in df[ce.get("input_id")].dropna().unique():
+                    resolve_dimension(intacct_id, value)
+        journal_entries = _build_parallel(df, config, references, resolved_dimensions, processes)
+    else:
+        journal_entries = [
+            _build_journal_entry(x, config, references, resolve_dimension)
+            for _, x in df.groupby("Journal Entry Id")
+        ]
 
     # Print journal entries
     logger.info(f"Loaded {len(journal_entries)} journal entries to post")
@@ -203,37 +419,113 @@ def load_journal_entries(client, config, accounts, classes, customers, locations
     return journal_entries
 
 
-def upload(config, intacct_client) -> None:
+def load_references(intacct_client) -> Dict[str, List[Dict]]:
+    """Load the active reference data journal lines are matched against."""
+    # Load Active Classes, Customers, Accounts
+    return {
+        'accounts': intacct_client.get_entity(object_type="general_ledger_accounts", fields=["RECORDNO", "ACCOUNTNO", "TITLE"]),
+        'classes': intacct_client.get_entity(object_type="classes", fields=["RECORDNO", "CLASSID", "NAME"]),
+        'customers': intacct_client.get_entity(object_type="customers", fields=["CUSTOMERID", "NAME"]),
+        'locations': intacct_client.get_entity(object_type="locations", fields=["LOCATIONID", "NAME", "ENTITY"]),
+        'departments': intacct_client.get_entity(object_type="departments", fields=["DEPARTMENTID", "TITLE"]),
+        'items': intacct_client.get_entity(object_type="items", fields=["ITEMID", "NAME"]),
+    }
+
+
+def _check_posting_deadlines(config) -> None:
+    """
+    Without idempotent_creates a create is only sent with the full read_timeout left
+    before the deadline, so a deadline that short could never post a journal.
+    """
+    if config.get('idempotent_creates', False):
+        return
+    read_timeout = config.get('read_timeout', DEFAULT_READ_TIMEOUT)
+    for key in ('posting_deadline_seconds', 'run_deadline_seconds'):
+        seconds = config.get(key)
+        if seconds is not None and seconds <= read_timeout:
+            raise Exception(
+                f"{key} ({seconds}s) must be longer than read_timeout ({read_timeout}s): without "
+                f"idempotent_creates, journals are only posted with the full read timeout left. "
+                f"Raise {key}, lower read_timeout or set idempotent_creates."
+            )
+
+
+def upload(config, intacct_client, reference_loader=load_references) -> int:
     """
     Syncs all streams selected in Context.catalog.
     Writes out state file for events stream once sync completed.
+    `reference_loader(intacct_client)` returns the reference data; pass one that
+    caches load_references to reuse it between uploads.
+    Returns the number of journals posted.
     """
+    _check_posting_deadlines(config)
+
+    # run_deadline_seconds bounds the whole upload; the phase deadlines are nested in it.
+    run_deadline = Deadline(config.get('run_deadline_seconds'), 'run')
+    intacct_client.set_deadline(run_deadline)
+    try:
+        return _upload(config, intacct_client, reference_loader, run_deadline)
+    finally:
+        intacct_client.set_deadline(None)
+
+
+def _upload(config, intacct_client, reference_loader, run_deadline) -> int:
     logger.info('Starting upload.')
 
-    # Load Active Classes, Customers, Accounts
-    accounts = intacct_client.get_entity(object_type="general_ledger_accounts", fields=["RECORDNO", "ACCOUNTNO", "TITLE"])
-    classes = intacct_client.get_entity(object_type="classes", fields=["RECORDNO", "CLASSID", "NAME"])
-    customers = intacct_client.get_entity(object_type="customers", fields=["CUSTOMERID", "NAME"])
-    locations = intacct_client.get_entity(object_type="locations", fields=["LOCATIONID", "NAME", "ENTITY"])
-    departments = intacct_client.get_entity(object_type="departments", fields=["DEPARTMENTID", "TITLE"])
-    items = intacct_client.get_entity(object_type="items", fields=["ITEMID", "NAME"])
+    api_budget = intacct_client.api_budget
+    # Clients can be reused across uploads, so report only this upload's calls.
+    calls_before = dict(api_budget.counts)
+    df = read_journal_entries(config)
+    estimate = estimate_api_calls(config, df, api_budget.reference_sizes)
+    logger.info(f"Estimated API calls for this run: {json.dumps(estimate)}")
+    remaining = api_budget.remaining()
+    if remaining is not None and estimate['total'] > remaining:
+        message = f"Estimated {estimate['total']} API calls but only {remaining} remain in the quota window"
+        if api_budget.on_exhausted == 'stop':
+            raise ApiQuotaExceededError(f"{message}. Deferring this run.")
+        logger.warning(f"{message}. The run will wait for the next window when the quota is used up.")
+
+    # A reused client may still be logged in to an entity from an earlier upload.
+    if intacct_client.location_id is not None:
+        intacct_client.use_entity_session(None)
+
+    intacct_client.set_deadline(
+        Deadline(config.get('reference_deadline_seconds'), 'reference loading', parent=run_deadline)
+    )
+    references = reference_loader(intacct_client)
+    intacct_client.set_deadline(run_deadline)
+
     # Load Journal Entries CSV to post + Convert to Intacct format
-    journal_entries = load_journal_entries(intacct_client, config, accounts, classes, customers, locations, departments, items)
+    journal_entries = load_journal_entries(
+        intacct_client,
+        config,
+        references['accounts'],
+        references['classes'],
+        references['customers'],
+        references['locations'],
+        references['departments'],
+        references['items'],
+        df=df,
+    )
 
     # post_to_top_level=true keeps legacy top-level login. Default false: when every
     # line on a journal shares a location, re-login with that location entity.
     post_to_top_level = config.get('post_to_top_level', False)
     session_location = None  # None == top-level session from initial login
 
-    for je in journal_entries:
+    intacct_client.set_deadline(
+        Deadline(config.get('posting_deadline_seconds'), 'posting', parent=run_deadline)
+    )
+
+    def post(je):
+        nonlocal session_location
         if not post_to_top_level:
-            shared = _shared_line_location(je['ENTRIES']['GLENTRY'])
-            entity_id = _entity_location_id(shared, locations) if shared else None
+            entity_id = je['_ENTITY']
             if entity_id != session_location:
                 if entity_id:
                     logger.info(
-                        f"Journal {je['BATCH_TITLE']}: all lines share location "
-                        f"{shared}; logging in with locationid={entity_id}"
+                        f"Journal {je['BATCH_TITLE']}: all lines share a location "
+                        f"in entity {entity_id}; logging in with locationid={entity_id}"
                     )
                 else:
                     logger.info(
@@ -242,18 +534,102 @@ def upload(config, intacct_client) -> None:
                     )
                 intacct_client.use_entity_session(entity_id)
                 session_location = entity_id
-        intacct_client.post_journal(je)
-
-    logger.info('Upload completed')
-
-
-@singer.utils.handle_top_exception(logger)
-def main() -> None:
-    args = singer.utils.parse_args(REQUIRED_CONFIG_KEYS)
-    config = args.config
-
-    # Login
-    intacct_client = get_client(
+        intacct_client.post_journal(_journal_payload(je))
+
+    def log_api_calls():
+        logger.info(f"Made {api_budget.summary(since=calls_before)}; estimated {estimate['total']}")
+
+    # continue_on_error=true posts every journal it can: permanent failures go to the
+    # dead-letter file. Transient ones are retried once after the main pass, but only
+    # with idempotent_creates; otherwise the first attempt may have been posted.
+    if not config.get('continue_on_error', False):
+        for je in journal_entries:
+            post(je)
+
+        logger.info('Upload completed')
+        log_api_calls()
+        return len(journal_entries)
+
+    retry_transient = config.get('idempotent_creates', False)
+    failed = []
+    retry_queue = []
+    # Set when a deadline, the API quota or the credentials end the run; the journals
+    # from that point on were never sent.
+    stop = None
+    not_attempted = []
+
+    for i, je in enumerate(journal_entries):
+        try:
+            post(je)
+        except RUN_STOP_ERRORS as exc:
+            logger.error(f"Stopping at journal {je['BATCH_TITLE']}: {exc}")
+            stop = exc
+            not_attempted = journal_entries[i:]
+            break
+        except TRANSIENT_ERRORS as exc:
+            if not retry_transient:
+                logger.error(f"Journal {je['BATCH_TITLE']} failed and may or may not have been posted: {exc}")
+                failed.append((je, exc))
+                continue
+            logger.warning(f"Journal {je['BATCH_TITLE']} failed with a temporary error, will retry: {exc}")
+            retry_queue.append((je, exc))
+        except SageIntacctSDKError as exc:
+            logger.error(f"Journal {je['BATCH_TITLE']} failed: {exc}")
+            failed.append((je, exc))
+
+    if retry_queue and stop is None:
+        logger.info(f"Retrying {len(retry_queue)} journals that failed with temporary errors")
+    for i, (je, first_exc) in enumerate(retry_queue):
+        if stop is not None:
+            failed.extend(retry_queue[i:])
+            break
+        try:
+            post(je)
+        except RUN_STOP_ERRORS as exc:
+            logger.error(f"Stopping at journal {je['BATCH_TITLE']}: {exc}")
+            stop = exc
+            failed.append((je, first_exc))
+        except (SageIntacctSDKError, *TRANSIENT_ERRORS) as exc:
+            logger.error(f"Journal {je['BATCH_TITLE']} failed again on retry: {exc}")
+            failed.append((je, exc))
+
+    posted = len(journal_entries) - len(failed) - len(not_attempted)
+    logger.info(
+        f"Upload completed: {posted} journals posted, {len(failed)} failed, {len(not_attempted)} not attempted"
+    )
+    log_api_calls()
+
+    if failed or not_attempted:
+        dead_letter_path = config.get('dead_letter_path') or f"{config['input_path']}/failed_journals.jsonl"
+        _write_dead_letter(dead_letter_path, failed, not_attempted, stop)
+    if stop is not None:
+        raise stop
+    if failed:
+        raise Exception(f"{len(failed)} journals failed to post. See {dead_letter_path}")
+
+    return posted
+
+
+# Config keys get_client_from_config builds a client from.
+CLIENT_CONFIG_KEYS = [
+    'api_url',
+    *REQUIRED_CONFIG_KEYS,
+    'user_agent',
+    'api_quota',
+    'api_quota_window_seconds',
+    'api_quota_on_exhausted',
+    'api_quota_state_path',
+    'idempotent_creates',
+    'hedge_after_seconds',
+    'connect_timeout',
+    'read_timeout',
+    'slow_call_seconds',
+]
+
+
+def get_client_from_config(config, **kwargs) -> SageIntacctSDK:
+    """Log in with the credentials and client options in `config`; kwargs are passed to get_client."""
+    return get_client(
         api_url=config.get('api_url', DEFAULT_API_URL),
         company_id=config['company_id'],
         sender_id=config['sender_id'],
@@ -261,8 +637,26 @@ def main() -> None:
         user_id=config['user_id'],
         user_password=config['user_password'],
         headers={'User-Agent': config['user_agent']} if 'user_agent' in config else {},
+        api_budget=get_api_budget(config),
+        idempotent_creates=config.get('idempotent_creates', False),
+        hedge_after=config.get('hedge_after_seconds'),
+        timeout=(
+            config.get('connect_timeout', DEFAULT_CONNECT_TIMEOUT),
+            config.get('read_timeout', DEFAULT_READ_TIMEOUT),
+        ),
+        slow_call_seconds=config.get('slow_call_seconds'),
+        **kwargs,
     )
 
+
+@singer.utils.handle_top_exception(logger)
+def main() -> None:
+    args = singer.utils.parse_args(REQUIRED_CONFIG_KEYS)
+    config = args.config
+
+    # Login
+    intacct_client = get_client_from_config(config)
+
     # Upload the data
     upload(config, intacct_client)
 
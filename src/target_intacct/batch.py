@@ -0,0 +1,138 @@
+"""
+Batch mode: upload many company configs in one process.
+
+The manifest is a JSON file such as:
+
+    {
+        "workers": 8,
+        "rate_limit": 10,
+        "tenants": [
+            {"name": "acme", "config": "acme/config.json", "input_path": "acme/input"},
+            {"name": "globex", "config": {...}, "input_path": "/data/globex"}
+        ]
+    }
+
+`config` is either a path to a regular target config or the config itself, and
+`input_path` (optional) overrides the config's own. Relative paths are resolved
+against the manifest's directory.
+"""
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List
+
+import singer
+
+from target_intacct import get_client_from_config, upload
+from target_intacct.client import RateLimiter
+from target_intacct.const import REQUIRED_CONFIG_KEYS
+
+logger = singer.get_logger()
+
+DEFAULT_WORKERS = 4
+
+# Requests per second shared by every tenant in the batch.
+DEFAULT_RATE_LIMIT = 10
+
+
+def _load_tenant_config(tenant: Dict, base_dir: Path) -> Dict:
+    config = tenant['config']
+    if not isinstance(config, dict):
+        with open(base_dir / config) as f:
+            config = json.load(f)
+    config = dict(config)
+
+    if tenant.get('input_path'):
+        config['input_path'] = str(base_dir / tenant['input_path'])
+
+    missing = [key for key in REQUIRED_CONFIG_KEYS if key not in config]
+    if missing:
+        raise Exception(f"Config is missing required keys: {missing}")
+
+    return config
+
+
+def _tenant_name(tenant: Dict) -> str:
+    """Name to report a tenant under before its config is loaded."""
+    if tenant.get('name'):
+        return tenant['name']
+    # An inline config holds credentials, so only a config path is safe to log.
+    return tenant['config'] if isinstance(tenant.get('config'), str) else 'unnamed'
+
+
+def run_tenant(tenant: Dict, base_dir: Path, rate_limiter: RateLimiter) -> Dict:
+    """
+    Loads a tenant's config, logs in and uploads it with its own SageIntacctSDK.
+    Returns throughput stats; failures (including a bad config) are recorded
+    rather than raised so one tenant cannot stop the batch.
+    """
+    start = time.monotonic()
+    stats = {'name': _tenant_name(tenant), 'journals': 0, 'error': None}
+    try:
+        config = _load_tenant_config(tenant, base_dir)
+        stats['name'] = tenant.get('name') or config['company_id']
+        intacct_client = get_client_from_config(config, rate_limiter=rate_limiter, rate_limit_key=stats['name'])
+        stats['journals'] = upload(config, intacct_client)
+    except (Exception, SystemExit) as exc:
+        # load_journal_entries exits on a malformed CSV; keep that local to the tenant.
+        logger.exception(f"Tenant {stats['name']} failed: {exc!r}")
+        stats['error'] = repr(exc)
+
+    stats['seconds'] = time.monotonic() - start
+    return stats
+
+
+def _log_report(results: List[Dict], seconds: float) -> None:
+    for stats in results:
+        rate = stats['journals'] / stats['seconds'] if stats['seconds'] else 0.0
+        status = 'FAILED' if stats['error'] else 'ok'
+        logger.info(
+            f"Tenant {stats['name']}: {status}, {stats['journals']} journals in "
+            f"{stats['seconds']:.1f}s ({rate:.2f} journals/s)"
+        )
+
+    total = sum(stats['journals'] for stats in results)
+    failed = sum(1 for stats in results if stats['error'])
+    rate = total / seconds if seconds else 0.0
+    logger.info(
+        f"Batch completed: {len(results)} tenants ({failed} failed), {total} journals "
+        f"in {seconds:.1f}s ({rate:.2f} journals/s)"
+    )
+
+
+def run_batch(manifest: Dict, base_dir: Path) -> List[Dict]:
+    """Runs every tenant in the manifest on a shared worker pool and rate budget."""
+    tenants = manifest['tenants']
+    rate_limiter = RateLimiter(manifest.get('rate_limit', DEFAULT_RATE_LIMIT), 1)
+    workers = manifest.get('workers', DEFAULT_WORKERS)
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_tenant, tenant, base_dir, rate_limiter) for tenant in tenants]
+        results = [future.result() for future in futures]
+
+    _log_report(results, time.monotonic() - start)
+    return results
+
+
+@singer.utils.handle_top_exception(logger)
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-m', '--manifest', help='Batch manifest file', required=True)
+    args = parser.parse_args()
+
+    manifest_path = Path(args.manifest).resolve()
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+
+    results = run_batch(manifest, manifest_path.parent)
+
+    if any(stats['error'] for stats in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+"""
+API transaction accounting.
+
+Intacct limits and bills API transactions per company. ApiBudget counts the
+calls a client makes per function type and, when a quota is configured, keeps a
+run inside it. estimate_api_calls predicts how many calls an upload will make.
+"""
+import collections
+import contextlib
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from typing import Dict, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: the state file is only safe for a single writer
+    fcntl = None
+
+import pandas as pd
+
+import singer
+
+from target_intacct.exceptions import ApiQuotaExceededError
+
+logger = singer.get_logger()
+
+# Reference objects loaded by upload() before posting.
+REFERENCE_OBJECTS = [
+    'general_ledger_accounts',
+    'classes',
+    'customers',
+    'locations',
+    'departments',
+    'items',
+]
+
+# Records per page in SageIntacctSDK.get_entity.
+PAGE_SIZE = 1000
+
+
+class ApiBudget:
+    """
+    Counts API calls per function type and enforces an optional quota.
+
+    The quota applies to fixed windows of `window_seconds` aligned to the epoch
+    (UTC days by default). When it is used up, `on_exhausted='wait'` sleeps until
+    the next window and `'stop'` raises ApiQuotaExceededError. With `state_path`
+    the window usage, and the reference sizes seen by get_entity, survive between
+    runs so several runs on one company share the allowance. Every call re-reads
+    and rewrites the state file under a lock, so concurrent runs (threads or
+    processes) sharing it keep an exact count.
+    """
+
+    def __init__(
+        self,
+        quota: Optional[int] = None,
+        window_seconds: int = 86400,
+        on_exhausted: str = 'wait',
+        state_path: Optional[str] = None,
+    ):
+        if on_exhausted not in ('wait', 'stop'):
+            raise ValueError(f"on_exhausted must be 'wait' or 'stop', got {on_exhausted!r}")
+
+        self.quota = quota
+        self.window_seconds = window_seconds
+        self.on_exhausted = on_exhausted
+        self.state_path = state_path
+        self.counts = collections.Counter()
+        self.reference_sizes = {}
+        self._window_start = self._current_window()
+        self._window_used = 0
+        self._lock = threading.Lock()
+
+        with self._locked_state() as state:
+            self.reference_sizes = state.get('reference_sizes', {})
+
+    def _current_window(self) -> int:
+        return int(time.time() // self.window_seconds * self.window_seconds)
+
+    def _roll_window(self) -> None:
+        window = self._current_window()
+        if window != self._window_start:
+            self._window_start = window
+            self._window_used = 0
+
+    @contextlib.contextmanager
+    def _locked_state(self):
+        """
+        Holds the budget lock, and the state file's lock when there is one, and
+        yields the saved state after bringing the current window's usage up to date.
+        """
+        with self._lock:
+            if not self.state_path:
+                self._roll_window()
+                yield {}
+                return
+
+            with open(self.state_path + '.lock', 'a') as lock_file:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                state = {}
+                if os.path.exists(self.state_path):
+                    with open(self.state_path) as f:
+                        state = json.load(f)
+                self._roll_window()
+                if state.get('window_start') == self._window_start:
+                    self._window_used = state.get('window_used', 0)
+                yield state
+                # Released when lock_file is closed.
+
+    def _write_state(self) -> None:
+        """Replaces the state file atomically. Call inside _locked_state."""
+        if not self.state_path:
+            return
+        directory = os.path.dirname(os.path.abspath(self.state_path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.api_budget.')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(
+                    {
+                        'window_start': self._window_start,
+                        'window_used': self._window_used,
+                        'reference_sizes': self.reference_sizes,
+                    },
+                    f,
+                )
+            os.replace(tmp_path, self.state_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def save(self) -> None:
+        with self._locked_state():
+            self._write_state()
+
+    def remaining(self) -> Optional[int]:
+        """Calls left in the current window, or None without a quota."""
+        if self.quota is None:
+            return None
+        with self._locked_state():
+            return max(self.quota - self._window_used, 0)
+
+    def acquire(self, function: str) -> None:
+        """Account for one call of `function`, waiting or raising if the quota is used up."""
+        while True:
+            with self._locked_state():
+                if self.quota is None or self._window_used < self.quota:
+                    self._window_used += 1
+                    self.counts[function] += 1
+                    self._write_state()
+                    return
+                if self.on_exhausted == 'stop':
+                    raise ApiQuotaExceededError(
+                        f"API quota of {self.quota} calls per {self.window_seconds}s is used up"
+                    )
+                wait = self._window_start + self.window_seconds - time.time()
+
+            logger.warning(f"API quota of {self.quota} calls is used up. Waiting {wait:.0f}s for the next window.")
+            time.sleep(max(wait, 0))
+
+    def record_reference_size(self, object_type: str, count: int) -> None:
+        with self._lock:
+            self.reference_sizes[object_type] = count
+
+    def summary(self, since: Optional[Dict[str, int]] = None) -> str:
+        """Describe the calls made, optionally only those after a copy of `counts`."""
+        counts = self.counts - collections.Counter(since or {})
+        calls = ', '.join(f"{function}={count}" for function, count in sorted(counts.items()))
+        return f"{sum(counts.values())} API calls ({calls})"
+
+
+def get_api_budget(config: Dict) -> ApiBudget:
+    """Builds the ApiBudget described by the api_quota* config keys."""
+    return ApiBudget(
+        quota=config.get('api_quota'),
+        window_seconds=config.get('api_quota_window_seconds', 86400),
+        on_exhausted=config.get('api_quota_on_exhausted', 'wait'),
+        state_path=config.get('api_quota_state_path'),
+    )
+
+
+def estimate_api_calls(config: Dict, df: pd.DataFrame, reference_sizes: Optional[Dict] = None) -> Dict[str, int]:
+    """
+    Estimate the API calls an upload of the journal lines in `df` will make.
+
+    Reference sizes not known from a previous run count as a single page.
+    Custom fields are assumed to be UDDs, so their lookups are an upper bound.
+
+    Returns:
+        Call counts by purpose, including a 'total'.
+    """
+    reference_sizes = reference_sizes or {}
+    custom_fields = config.get("custom_fields") or []
+
+    estimate = {'login': 1}
+    estimate['reference_queries'] = sum(
+        1 + max(math.ceil(reference_sizes.get(object_type, 1) / PAGE_SIZE), 1)
+        for object_type in REFERENCE_OBJECTS
+    )
+
+    estimate['custom_field_lookups'] = 0
+    for ce in custom_fields:
+        column = ce.get("input_id")
+        distinct = df[column].dropna().nunique() if column in df.columns else 0
+        estimate['custom_field_lookups'] += 1 + distinct
+
+    estimate['location_logins'] = 0
+    if not config.get('post_to_top_level', False) and 'Location' in df.columns:
+        session = None
+        for _, x in df.groupby("Journal Entry Id"):
+            locations = x['Location']
+            shared = locations.iloc[0] if locations.notna().all() and locations.nunique() == 1 else None
+            if shared != session:
+                estimate['location_logins'] += 1
+                session = shared
+
+    estimate['journal_creates'] = df["Journal Entry Id"].nunique()
+    estimate['total'] = sum(estimate.values())
+    return estimate
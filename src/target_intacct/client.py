@@ -1,12 +1,17 @@
 """
 API Base class with util functions
 """
+import collections
 import datetime as dt
+import hashlib
 import json
+import math
 import re
 import sys
-import uuid
-from typing import Dict, List, Union
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from typing import Dict, Hashable, List, Optional, Tuple, Union
 from urllib.parse import unquote
 
 import backoff
@@ -16,6 +21,8 @@ import xmltodict
 import singer
 
 from target_intacct.exceptions import (
+    DeadlineExceededError,
+    DuplicateRequestError,
     ExpiredTokenError,
     InternalServerError,
     InvalidTokenError,
@@ -26,7 +33,9 @@ from target_intacct.exceptions import (
     WrongParamsError,
 )
 
+from .budget import ApiBudget
 from .const import GET_BY_DATE_FIELD, INTACCT_OBJECTS
+from .serializer import RequestSerializer
 
 logger = singer.get_logger()
 
@@ -34,8 +43,29 @@ GATEWAY_ERROR_PATTERN = re.compile(r'^GW-\d+$')
 
 RETRYABLE_STATUS_CODES = (429, 502, 503, 504)
 
+# A uniqueid request whose control id was already processed is refused with this error
+# alone. The same number is Intacct's generic "transaction rolled back" error that comes
+# with almost every failed function, so the description must name the control id too.
+DUPLICATE_CONTROL_ID_ERRORNO = 'XL03000009'
+
+# Functions that change nothing in Intacct, so sending them twice is harmless.
+READ_FUNCTIONS = ('query', 'readByQuery', 'read', 'lookup')
+
 MAX_RETRIES = 5
 
+# Threads per client for hedged requests. A losing copy can still be in flight while
+# the next hedged call starts.
+HEDGE_POOL_SIZE = 4
+
+# Seconds to wait for a connection to the gateway and for its response.
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 300
+
+
+def _log_hedge_loser(future) -> None:
+    if not future.cancelled() and future.exception() is not None:
+        logger.info(f"A hedged request copy failed after the other copy answered: {future.exception()!r}")
+
 
 def _log_retry(details):
     _, exc, _ = sys.exc_info()
@@ -48,6 +78,15 @@ def _log_retry(details):
     )
 
 
+_retry_temporary_errors = backoff.on_exception(
+    backoff.expo,
+    (RetryableIntacctError, requests.exceptions.ConnectionError),
+    max_tries=MAX_RETRIES,
+    factor=2,
+    on_backoff=_log_retry,
+)
+
+
 def _has_temporary_error(parsed_response: Dict) -> bool:
     """Returns True when the parsed response contains a gateway (GW-nnnn) error."""
     try:
@@ -64,6 +103,107 @@ def _has_temporary_error(parsed_response: Dict) -> bool:
         if isinstance(error, dict)
     )
 
+class Deadline:
+    """
+    A point in time a phase of work must finish by. `seconds=None` never
+    expires on its own; a `parent` deadline (e.g. the whole run) still applies.
+    """
+
+    def __init__(self, seconds: Optional[float], name: str, parent: Optional['Deadline'] = None):
+        self.name = name
+        self.parent = parent
+        self._expires = time.monotonic() + seconds if seconds is not None else math.inf
+
+    def remaining(self) -> float:
+        remaining = self._expires - time.monotonic()
+        if self.parent is not None:
+            remaining = min(remaining, self.parent.remaining())
+        return remaining
+
+    def check(self) -> None:
+        """Raises DeadlineExceededError once this deadline (or its parent's) has passed."""
+        if self.parent is not None:
+            self.parent.check()
+        if self._expires - time.monotonic() <= 0:
+            raise DeadlineExceededError(f"The {self.name} deadline has passed")
+
+
+class RateLimiter:
+    """
+    Thread-safe sliding-window rate limiter that can be shared by several
+    SageIntacctSDK instances.
+
+    At most `limit` requests are let through every `every` seconds. While more
+    than one key (tenant) is waiting, each key is held to an even share of the
+    window so one busy tenant cannot starve the others.
+    """
+
+    def __init__(self, limit: int, every: float):
+        self.limit = limit
+        self.every = every
+        self._calls = collections.deque()
+        self._waiting = collections.Counter()
+        self._condition = threading.Condition()
+
+    def _fair_share_left(self, key: Hashable) -> bool:
+        share = math.ceil(self.limit / max(len(self._waiting), 1))
+        used = sum(1 for _, call_key in self._calls if call_key == key)
+        return used < share
+
+    def wait(self, key: Hashable = None) -> None:
+        """Blocks until `key` may send one more request."""
+        with self._condition:
+            self._waiting[key] += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    while self._calls and now - self._calls[0][0] >= self.every:
+                        self._calls.popleft()
+
+                    if len(self._calls) < self.limit and self._fair_share_left(key):
+                        self._calls.append((now, key))
+                        return
+
+                    timeout = self.every - (now - self._calls[0][0]) if self._calls else self.every
+                    self._condition.wait(timeout)
+            finally:
+                self._waiting[key] -= 1
+                if not self._waiting[key]:
+                    del self._waiting[key]
+                self._condition.notify_all()
+
+
+# Process-wide default, equivalent to the former singer ratelimit(10, 1) on _post_request.
+DEFAULT_RATE_LIMITER = RateLimiter(10, 1)
+
+
+def _errors(errormessage) -> List[Dict]:
+    """Returns the error entries of an Intacct errormessage element."""
+    errors = (errormessage or {}).get('error') if isinstance(errormessage, dict) else None
+    if isinstance(errors, dict):
+        errors = [errors]
+    return [error for error in errors or [] if isinstance(error, dict)]
+
+
+def _error_text(error: Dict) -> str:
+    return ' '.join(str(error.get(field) or '') for field in ('description', 'description2'))
+
+
+def _has_duplicate_control_id(errormessage) -> bool:
+    """
+    Returns True when Intacct refused a request only because its control id was
+    already used. Any other error alongside it means the request was rejected.
+    """
+    errors = _errors(errormessage)
+    if len(errors) != 1:
+        return False
+    error = errors[0]
+    return (
+        error.get('errorno') == DUPLICATE_CONTROL_ID_ERRORNO
+        and 'controlid' in _error_text(error).lower().replace(' ', '')
+    )
+
+
 def _format_date_for_intacct(datetime: dt.datetime) -> str:
     """
     Intacct expects datetimes in a 'MM/DD/YY HH:MM:SS' string format.
@@ -88,6 +228,14 @@ class SageIntacctSDK:
         user_id: str,
         user_password: str,
         headers: Dict,
+        rate_limiter: Optional[RateLimiter] = None,
+        rate_limit_key: Hashable = None,
+        api_budget: Optional[ApiBudget] = None,
+        session_ttl: Optional[float] = None,
+        idempotent_creates: bool = False,
+        hedge_after: Optional[float] = None,
+        timeout: Tuple[float, float] = (DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT),
+        slow_call_seconds: Optional[float] = None,
     ):
         self.__api_url = api_url
         self.__gateway_url = api_url
@@ -100,6 +248,28 @@ class SageIntacctSDK:
         self.__user_id = user_id
         self.__user_password = user_password
         self.__headers = headers
+        # Batch runs share one limiter between tenants; rate_limit_key keeps the split fair.
+        self.__rate_limiter = rate_limiter or DEFAULT_RATE_LIMITER
+        self.__rate_limit_key = rate_limit_key
+        self.__api_budget = api_budget or ApiBudget()
+        # Keep-alive connection pool for every request this client makes.
+        self.__http = requests.Session()
+        # With session_ttl, sessions are kept per location entity and reused
+        # instead of logging in again on every switch.
+        self.__session_ttl = session_ttl
+        self.__sessions = {}
+        self.__location_id = None
+        # Content-derived control ids with uniqueid make a repeated create a no-op,
+        # which is what makes retries and hedged requests safe for creates.
+        self.__idempotent_creates = idempotent_creates
+        self.__hedge_after = hedge_after
+        self.__hedge_pool = ThreadPoolExecutor(max_workers=HEDGE_POOL_SIZE) if hedge_after is not None else None
+        # (connect, read) timeouts turn a stalled connection into an exception backoff can act on.
+        self.__timeout = timeout
+        self.__slow_call_seconds = slow_call_seconds
+        self.__deadline = None
+        # Custom-field dimension definitions, discovered once per company via lookup.
+        self.__dimensions = {}
 
         """
         Initialize connection to Sage Intacct
@@ -130,7 +300,6 @@ class SageIntacctSDK:
         (subsidiary). Omit it to stay at top-level.
         """
 
-        timestamp = dt.datetime.now()
         login = {
             'userid': user_id,
             'companyid': company_id,
@@ -139,42 +308,59 @@ class SageIntacctSDK:
         if location_id:
             login['locationid'] = location_id
 
-        dict_body = {
-            'request': {
-                'control': {
-                    'senderid': self.__sender_id,
-                    'password': self.__sender_password,
-                    'controlid': timestamp,
-                    'uniqueid': False,
-                    'dtdversion': 3.0,
-                    'includewhitespace': False,
-                },
-                'operation': {
-                    'authentication': {
-                        'login': login
-                    },
-                    'content': {
-                        'function': {
-                            '@controlid': str(uuid.uuid4()),
-                            'getAPISession': None,
-                        }
-                    },
-                },
-            }
-        }
+        login_serializer = RequestSerializer(
+            self.__sender_id, self.__sender_password, {'login': login}
+        )
+        body = login_serializer.serialize('getAPISession', None)
 
-        response = self._post_request(dict_body, self.__gateway_url)
+        response = self._post_request(body, self.__gateway_url, 'getAPISession')
 
         if response['authentication']['status'] == 'success':
             session_details = response['result']['data']['api']
             self.__api_url = session_details['endpoint']
             self.__session_id = session_details['sessionid']
+            # The envelope only changes with the session, so render it once here.
+            self.__serializer = RequestSerializer(
+                self.__sender_id, self.__sender_password, {'sessionid': self.__session_id}
+            )
+            self.__location_id = location_id
+            self.__sessions[location_id] = (
+                time.monotonic(), self.__api_url, self.__session_id, self.__serializer
+            )
 
         else:
             raise SageIntacctSDKError('Error: {0}'.format(response['errormessage']))
 
+    @property
+    def api_budget(self) -> ApiBudget:
+        """Per-function call counts and quota for this client."""
+        return self.__api_budget
+
+    def set_deadline(self, deadline: Optional[Deadline]) -> None:
+        """Requests fail with DeadlineExceededError once `deadline` has passed; None clears it."""
+        self.__deadline = deadline
+
+    @property
+    def location_id(self) -> Optional[str]:
+        """Location entity of the current session; None at top-level."""
+        return self.__location_id
+
+    def close(self) -> None:
+        """Close the pooled HTTP connections. The client must not be used afterwards."""
+        if self.__hedge_pool is not None:
+            # Hedged copies still in flight must finish before their session is closed.
+            self.__hedge_pool.shutdown(wait=True)
+        self.__sessions.clear()
+        self.__http.close()
+
     def use_entity_session(self, location_id: str = None):
         """Re-authenticate, optionally scoped to a location entity."""
+        cached = self.__sessions.get(location_id)
+        if self.__session_ttl and cached and time.monotonic() - cached[0] < self.__session_ttl:
+            _, self.__api_url, self.__session_id, self.__serializer = cached
+            self.__location_id = location_id
+            return
+
         self._set_session_id(
             user_id=self.__user_id,
             company_id=self.__company_id,
@@ -182,31 +368,68 @@ class SageIntacctSDK:
             location_id=location_id,
         )
 
-    @backoff.on_exception(
-        backoff.expo,
-        (RetryableIntacctError, requests.exceptions.ConnectionError),
-        max_tries=MAX_RETRIES,
-        factor=2,
-        on_backoff=_log_retry,
-    )
-    @singer.utils.ratelimit(10, 1)
-    def _post_request(self, dict_body: dict, api_url: str) -> Dict:
+    @_retry_temporary_errors
+    def _post_request(self, body: str, api_url: str, function: str, retry_timeouts: bool = True) -> Dict:
+        """Send a request with _send_request, retrying temporary errors."""
+        return self._send_request(body, api_url, function, retry_timeouts)
+
+    def _send_request(self, body: str, api_url: str, function: str, retry_timeouts: bool = True) -> Dict:
         """
-        Create a HTTP post request.
+        Create a HTTP post request (a single attempt).
 
         Parameters:
-            dict_body (dict): HTTP POST body data for the wanted API.
+            body (str): Serialized XML request for the wanted API.
             api_url (str): Url for the wanted API.
+            function (str): Intacct function in the body, counted against the API budget
+                on every attempt.
+            retry_timeouts (bool): Whether a read timeout may be retried, i.e. whether
+                sending the request twice is harmless.
 
         Returns:
             A response from the request (dict).
         """
 
+        connect_timeout, read_timeout = self.__timeout
+        if self.__deadline is not None:
+            self.__deadline.check()
+
+        self.__rate_limiter.wait(self.__rate_limit_key)
+
+        if self.__deadline is not None:
+            remaining = self.__deadline.remaining()
+            if retry_timeouts:
+                read_timeout = max(min(read_timeout, remaining), 0.001)
+            elif remaining < read_timeout:
+                # Cutting the wait short could abandon a request Intacct goes on to process,
+                # and it cannot be retried, so only send it with the full read timeout.
+                raise DeadlineExceededError(
+                    f"The {self.__deadline.name} deadline leaves {max(remaining, 0):.1f}s, less than the "
+                    f"{read_timeout}s read timeout needed to send a request that cannot be retried"
+                )
+
+        self.__api_budget.acquire(function)
+
         api_headers = {'content-type': 'application/xml'}
         api_headers.update(self.__headers)
-        body = xmltodict.unparse(dict_body)
         logger.info(f"Making request to {api_url} with body=[{body}]")
-        response = requests.post(api_url, headers=api_headers, data=body)
+        start = time.monotonic()
+        try:
+            response = self.__http.post(
+                api_url, headers=api_headers, data=body, timeout=(connect_timeout, read_timeout)
+            )
+        except requests.exceptions.ReadTimeout as exc:
+            if retry_timeouts:
+                raise RetryableIntacctError(
+                    'No response from Intacct within {0:.1f}s'.format(read_timeout), None
+                ) from exc
+            raise SageIntacctSDKError(
+                'No response from Intacct within {0:.1f}s; the request may or may not have been '
+                'processed, so it is not retried'.format(read_timeout)
+            ) from exc
+
+        elapsed = time.monotonic() - start
+        if self.__slow_call_seconds is not None and elapsed > self.__slow_call_seconds:
+            logger.warning(f"Slow Intacct call: {elapsed:.1f}s to {api_url}")
 
         try:
             parsed_xml = xmltodict.parse(response.text)
@@ -241,6 +464,11 @@ class SageIntacctSDK:
                 exception_msg = self.decode_support_id(
                     parsed_response['response']['errormessage']
                 )
+                if _has_duplicate_control_id(exception_msg):
+                    raise DuplicateRequestError(
+                        "Request was already processed: {0}".format(exception_msg),
+                        exception_msg,
+                    )
                 raise WrongParamsError(
                     "Some of the parameters are wrong: {0}".format(exception_msg),
                     exception_msg,
@@ -257,6 +485,20 @@ class SageIntacctSDK:
             if api_response['result']['status'] == 'success':
                 return api_response
 
+            result_error = api_response['result'].get('errormessage')
+            if _errors(result_error):
+                result_error = self.decode_support_id(result_error)
+            if _has_duplicate_control_id(result_error):
+                raise DuplicateRequestError(
+                    "Request was already processed: {0}".format(result_error),
+                    result_error,
+                )
+            if result_error:
+                raise WrongParamsError(
+                    "Some of the parameters are wrong: {0}".format(result_error),
+                    result_error,
+                )
+
         if response.status_code == 400:
             raise WrongParamsError(
                 "Some of the parameters are wrong: {0}".format(parsed_response),
@@ -317,7 +559,8 @@ class SageIntacctSDK:
         support_id_msg = self.support_id_msg(errormessages)
         data_type = support_id_msg['type']
         error = support_id_msg['error']
-        if error and error['description2']:
+        message = None
+        if error and error.get('description2'):
             message = error['description2']
             support_id = re.search('Support ID: (.*)]', message)
             if support_id and support_id.group(1):
@@ -349,30 +592,64 @@ class SageIntacctSDK:
         if key == "create":
             data[key].pop('object', None)
 
-        timestamp = dt.datetime.now()
-
-        dict_body = {
-            'request': {
-                'control': {
-                    'senderid': self.__sender_id,
-                    'password': self.__sender_password,
-                    'controlid': timestamp,
-                    'uniqueid': False,
-                    'dtdversion': 3.0,
-                    'includewhitespace': False,
-                },
-                'operation': {
-                    'authentication': {'sessionid': self.__session_id},
-                    'content': {
-                        'function': {'@controlid': str(uuid.uuid4()), key: data[key]}
-                    },
-                },
-            }
-        }
+        idempotent = key == 'create' and self.__idempotent_creates
+        control_id = self._content_control_id(key, data[key]) if idempotent else None
+        body = self.__serializer.serialize(
+            key, data[key], control_id=control_id, function_control_id=control_id, unique=idempotent
+        )
+        hedge = self.__hedge_after is not None and (idempotent or key in READ_FUNCTIONS)
         with singer.metrics.http_request_timer(endpoint=object_type):
-            response = self._post_request(dict_body, self.__api_url)
+            try:
+                if hedge:
+                    response = self._send_hedged(key, body)
+                else:
+                    # Resending a plain create after a read timeout could post it twice.
+                    response = self._post_request(
+                        body, self.__api_url, key, retry_timeouts=key != 'create' or idempotent
+                    )
+            except DuplicateRequestError:
+                if not idempotent:
+                    raise
+                logger.warning(
+                    f"{object_type} {key} with control id {control_id} was already processed by Intacct; not sending it again"
+                )
+                return {'status': 'success', 'function': key, 'controlid': control_id, 'data': None}
         return response['result']
 
+    def _content_control_id(self, key: str, payload: Dict) -> str:
+        """A control id derived from the company, function and payload, stable across retries and runs."""
+        content = json.dumps([self.__company_id, key, payload], sort_keys=True, default=str)
+        return f"{key}-{hashlib.sha256(content.encode('utf-8')).hexdigest()[:40]}"
+
+    @_retry_temporary_errors
+    def _send_hedged(self, key: str, body: str) -> Dict:
+        """
+        Post `body`, sending an identical second request if the first has not
+        answered after hedge_after seconds. The first success wins. Each copy is
+        sent once; a temporary failure of both retries the pair.
+        """
+        pool = self.__hedge_pool
+        futures = [pool.submit(self._send_request, body, self.__api_url, key)]
+        done, _ = wait(futures, timeout=self.__hedge_after)
+        if not done:
+            logger.info(f"{key} has not answered after {self.__hedge_after}s; sending a hedged request")
+            futures.append(pool.submit(self._send_request, body, self.__api_url, key))
+
+        errors = []
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as exc:
+                errors.append(exc)
+                continue
+            for other in futures:
+                if other is not future and not other.done():
+                    other.add_done_callback(_log_hedge_loser)
+            return result
+
+        # A duplicate only means the other request got there first; prefer its error.
+        raise next((e for e in errors if not isinstance(e, DuplicateRequestError)), errors[0])
+
     def get_entity(
         self, *, object_type: str, fields: List[str]
     ) -> List[Dict]:
@@ -395,6 +672,7 @@ class SageIntacctSDK:
 
         response = self.format_and_send_request(get_count)
         count = int(response['data']['@totalcount'])
+        self.__api_budget.record_reference_size(object_type, count)
         pagesize = 1000
         offset = 0
         for _i in range(0, count, pagesize):
@@ -474,6 +752,41 @@ class SageIntacctSDK:
         return response
 
 
+    def get_dimension(self, intacct_object: str) -> Dict:
+        """
+        Describe a custom-field dimension using `lookup`, cached for this company.
+
+        Returns:
+            {'udd': True, 'key_field': <id field>} when Intacct knows the object,
+            {'udd': False, 'key_field': None} when it does not (free text field).
+        """
+        intacct_object = intacct_object.upper()
+        if intacct_object in self.__dimensions:
+            return self.__dimensions[intacct_object]
+
+        try:
+            definition = self.get_definition(intacct_object)
+        except WrongParamsError as exc:
+            # Intacct rejected the lookup itself. Transport, credential, server, deadline and
+            # quota failures have their own exception types and still propagate.
+            logger.warning(
+                f"Intacct has no object {intacct_object} ({exc}). Treating it as a free text field."
+            )
+            dimension = {'udd': False, 'key_field': None}
+        else:
+            try:
+                fields = definition['data']['Type']['Fields']['Field']
+            except (KeyError, TypeError):
+                fields = []
+            if isinstance(fields, dict):
+                fields = [fields]
+            field_ids = [field.get('ID') for field in fields]
+            key_field = next((f for f in ('id', 'ID', 'RECORDNO') if f in field_ids), 'id')
+            dimension = {'udd': True, 'key_field': key_field}
+
+        self.__dimensions[intacct_object] = dimension
+        return dimension
+
     def get_data(self, intacct_object: str):
         """
         Get a sample of data from an endpoint, useful for determining schemas.
@@ -527,6 +840,14 @@ def get_client(
     user_id: str,
     user_password: str,
     headers: Dict,
+    rate_limiter: Optional[RateLimiter] = None,
+    rate_limit_key: Hashable = None,
+    api_budget: Optional[ApiBudget] = None,
+    session_ttl: Optional[float] = None,
+    idempotent_creates: bool = False,
+    hedge_after: Optional[float] = None,
+    timeout: Tuple[float, float] = (DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT),
+    slow_call_seconds: Optional[float] = None,
 ) -> SageIntacctSDK:
     """
     Initializes and returns a SageIntacctSDK object.
@@ -539,6 +860,14 @@ def get_client(
         user_id=user_id,
         user_password=user_password,
         headers=headers,
+        rate_limiter=rate_limiter,
+        rate_limit_key=rate_limit_key,
+        api_budget=api_budget,
+        session_ttl=session_ttl,
+        idempotent_creates=idempotent_creates,
+        hedge_after=hedge_after,
+        timeout=timeout,
+        slow_call_seconds=slow_call_seconds,
     )
 
     return connection
@@ -0,0 +1,163 @@
+"""
+Daemon mode: a long-running process that picks up upload jobs from a directory.
+
+Each job is a JSON file dropped into the jobs directory:
+
+    {"config": "/path/to/config.json", "input_path": "/data/acme"}
+
+`config` may also be the config itself. The daemon claims `<job>.json` by
+renaming it to `<job>.json.running`, uploads it, and writes
+`<job>.result.json` with the status, journals posted and latency.
+
+Between jobs it keeps one client per company (with its HTTP connection pool and
+per-entity sessions) and the reference data for that company in memory,
+dropping both after their TTL.
+"""
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Hashable, Optional
+
+import singer
+
+from target_intacct import CLIENT_CONFIG_KEYS, get_client_from_config, load_references, upload
+from target_intacct.const import REQUIRED_CONFIG_KEYS
+
+logger = singer.get_logger()
+
+DEFAULT_POLL_INTERVAL = 1.0
+
+# Seconds before a cached client (and its sessions) is replaced with a fresh login.
+DEFAULT_SESSION_TTL = 600
+
+# Seconds before reference data is downloaded again.
+DEFAULT_REFERENCE_TTL = 900
+
+
+class TTLCache:
+    """
+    A dict of values that are reloaded once they are older than `ttl` seconds.
+    `on_evict` is called with each value that expires or is invalidated.
+    """
+
+    def __init__(self, ttl: float, on_evict: Optional[Callable[[Any], None]] = None):
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self._entries = {}
+
+    def get(self, key: Hashable, load: Callable[[], Any]) -> Any:
+        entry = self._entries.get(key)
+        if entry and time.monotonic() - entry[0] < self.ttl:
+            return entry[1]
+        self.invalidate(key)
+        value = load()
+        self._entries[key] = (time.monotonic(), value)
+        return value
+
+    def invalidate(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry and self.on_evict:
+            self.on_evict(entry[1])
+
+
+class UploadDaemon:
+    """Runs upload jobs one at a time, reusing clients and reference data between them."""
+
+    def __init__(self, jobs_dir: str, session_ttl: float, reference_ttl: float):
+        self.jobs_dir = Path(jobs_dir)
+        self.session_ttl = session_ttl
+        self.clients = TTLCache(session_ttl, on_evict=lambda client: client.close())
+        self.references = TTLCache(reference_ttl)
+
+    def _client_key(self, config: Dict) -> tuple:
+        # Jobs for one company with different client options get their own client.
+        return tuple(json.dumps(config.get(key), sort_keys=True) for key in CLIENT_CONFIG_KEYS)
+
+    def _reference_key(self, config: Dict) -> tuple:
+        return tuple(config.get(key) for key in ['api_url', *REQUIRED_CONFIG_KEYS])
+
+    def _get_client(self, config: Dict):
+        return self.clients.get(
+            self._client_key(config),
+            # Entity sessions must expire before the client that holds them.
+            lambda: get_client_from_config(config, session_ttl=self.session_ttl),
+        )
+
+    def run_job(self, job: Dict) -> Dict:
+        """Upload a single job. Returns its result record."""
+        start = time.monotonic()
+        config = job['config']
+        if not isinstance(config, dict):
+            with open(config) as f:
+                config = json.load(f)
+        config = dict(config)
+        if job.get('input_path'):
+            config['input_path'] = job['input_path']
+
+        client_key = self._client_key(config)
+        reference_key = self._reference_key(config)
+        try:
+            intacct_client = self._get_client(config)
+            # Loaded inside upload() so a download counts against this job's deadline and API calls.
+            journals = upload(
+                config,
+                intacct_client,
+                reference_loader=lambda client: self.references.get(reference_key, lambda: load_references(client)),
+            )
+        except Exception:
+            # A failed job may have left a broken session behind; start fresh next time.
+            self.clients.invalidate(client_key)
+            raise
+
+        return {'status': 'success', 'journals': journals, 'seconds': time.monotonic() - start}
+
+    def process(self, path: Path) -> None:
+        running = path.with_name(path.name + '.running')
+        try:
+            os.rename(path, running)
+        except FileNotFoundError:
+            # Claimed by another daemon watching the same directory.
+            return
+
+        start = time.monotonic()
+        try:
+            with open(running) as f:
+                job = json.load(f)
+            result = self.run_job(job)
+        except (Exception, SystemExit) as exc:
+            logger.exception(f"Job {path.name} failed: {exc!r}")
+            result = {'status': 'failure', 'error': repr(exc), 'seconds': time.monotonic() - start}
+
+        logger.info(f"Job {path.name}: {result['status']} in {result['seconds']:.2f}s")
+        with open(path.with_name(path.stem + '.result.json'), 'w') as f:
+            json.dump(result, f)
+        os.remove(running)
+
+    def serve(self, poll_interval: float) -> None:
+        logger.info(f"Watching {self.jobs_dir} for upload jobs")
+        while True:
+            jobs = sorted(
+                p for p in self.jobs_dir.glob('*.json') if not p.name.endswith('.result.json')
+            )
+            for path in jobs:
+                self.process(path)
+            if not jobs:
+                time.sleep(poll_interval)
+
+
+@singer.utils.handle_top_exception(logger)
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-j', '--jobs-dir', help='Directory to pick up job files from', required=True)
+    parser.add_argument('--poll-interval', type=float, default=DEFAULT_POLL_INTERVAL)
+    parser.add_argument('--session-ttl', type=float, default=DEFAULT_SESSION_TTL)
+    parser.add_argument('--reference-ttl', type=float, default=DEFAULT_REFERENCE_TTL)
+    args = parser.parse_args()
+
+    UploadDaemon(args.jobs_dir, args.session_ttl, args.reference_ttl).serve(args.poll_interval)
+
+
+if __name__ == '__main__':
+    main()
@@ -36,6 +36,10 @@ class WrongParamsError(SageIntacctSDKError):
     """Some of the parameters (HTTP params or request body) are wrong, 400 error."""
 
 
+class DuplicateRequestError(WrongParamsError):
+    """A request with the same control id was already processed (uniqueid is set)."""
+
+
 class NotFoundItemError(SageIntacctSDKError):
     """Not found the item from URL, 404 error."""
 
@@ -47,3 +51,11 @@ class InternalServerError(SageIntacctSDKError):
 class RetryableIntacctError(SageIntacctSDKError):
     """A temporary error on Intacct's side (gateway GW-nnnn failures, rate
     limits, upstream 5xx) that is safe to retry."""
+
+
+class ApiQuotaExceededError(SageIntacctSDKError):
+    """The configured API transaction quota for the current window is used up."""
+
+
+class DeadlineExceededError(SageIntacctSDKError):
+    """A run or phase deadline passed before the request could be sent."""
@@ -0,0 +1,183 @@
+"""SageIntacctSDK response handling, against canned gateway responses."""
+import time
+
+import pytest
+import requests
+import xmltodict
+
+from target_intacct.client import get_client
+from target_intacct.exceptions import InternalServerError, WrongParamsError
+
+LOGIN_RESULT = (
+    '<result><status>success</status><function>getAPISession</function>'
+    '<data><api><sessionid>S1</sessionid><endpoint>https://api.intacct.test/</endpoint></api></data></result>'
+)
+
+ROLLED_BACK = (
+    '<error><errorno>XL03000009</errorno><description></description>'
+    '<description2>The entire transaction in this operation has been rolled back due to an error.</description2>'
+    '<correction></correction></error>'
+)
+
+INVALID_ACCOUNT = (
+    '<error><errorno>BL01001973</errorno><description></description>'
+    '<description2>Invalid Account Number 9999 specified.</description2>'
+    '<correction>Use a valid account number.</correction></error>'
+)
+
+DUPLICATE_CONTROL_ID = (
+    '<error><errorno>XL03000009</errorno><description></description>'
+    '<description2>A request with control ID create-abc has already been processed.</description2>'
+    '<correction>Use a unique control ID.</correction></error>'
+)
+
+
+class Response:
+    def __init__(self, text, status_code=200):
+        self.text = text
+        self.status_code = status_code
+
+
+def operation(result):
+    return Response(
+        '<?xml version="1.0" encoding="UTF-8"?><response>'
+        '<control><status>success</status></control>'
+        '<operation><authentication><status>success</status></authentication>'
+        f'{result}</operation></response>'
+    )
+
+
+def failure(function, *errors):
+    return operation(
+        f'<result><status>failure</status><function>{function}</function>'
+        f'<errormessage>{"".join(errors)}</errormessage></result>'
+    )
+
+
+@pytest.fixture
+def gateway(monkeypatch):
+    """Answers each function with the next canned response queued for it."""
+    responses = {}
+
+    def post(session, url, headers=None, data=None, timeout=None):
+        function = xmltodict.parse(data)['request']['operation']['content']['function']
+        key = next(k for k in function if not k.startswith('@'))
+        if key == 'getAPISession':
+            return operation(LOGIN_RESULT)
+        return responses[key].pop(0)
+
+    monkeypatch.setattr(requests.Session, 'post', post)
+    return responses
+
+
+def make_client(**kwargs):
+    return get_client(
+        api_url='https://api.intacct.test/',
+        company_id='company',
+        sender_id='sender',
+        sender_password='secret',
+        user_id='user',
+        user_password='secret',
+        headers={},
+        **kwargs,
+    )
+
+
+@pytest.mark.parametrize('idempotent_creates', [False, True])
+def test_rejected_create_with_rollback_error_is_not_a_duplicate(gateway, idempotent_creates):
+    gateway['create'] = [failure('create', ROLLED_BACK, INVALID_ACCOUNT)]
+    client = make_client(idempotent_creates=idempotent_creates)
+
+    with pytest.raises(WrongParamsError) as excinfo:
+        client.post_journal({'JOURNAL': 'GJ', 'BATCH_TITLE': 'JE-1'})
+
+    assert type(excinfo.value) is WrongParamsError
+
+
+def test_rollback_error_alone_is_not_a_duplicate(gateway):
+    gateway['create'] = [failure('create', ROLLED_BACK)]
+    client = make_client(idempotent_creates=True)
+
+    with pytest.raises(WrongParamsError) as excinfo:
+        client.post_journal({'JOURNAL': 'GJ', 'BATCH_TITLE': 'JE-1'})
+
+    assert type(excinfo.value) is WrongParamsError
+
+
+def test_duplicate_control_id_counts_as_posted(gateway):
+    gateway['create'] = [failure('create', DUPLICATE_CONTROL_ID)]
+    client = make_client(idempotent_creates=True)
+
+    result = client.post_journal({'JOURNAL': 'GJ', 'BATCH_TITLE': 'JE-1'})
+
+    assert result['status'] == 'success'
+
+
+def test_result_error_support_id_is_decoded(gateway):
+    error = (
+        '<error><errorno>BL01001973</errorno><description></description>'
+        '<description2>Could not create GLBATCH record. [Support ID: abc%7Edef]</description2>'
+        '<correction></correction></error>'
+    )
+    gateway['create'] = [failure('create', error)]
+    client = make_client()
+
+    with pytest.raises(WrongParamsError) as excinfo:
+        client.post_journal({'JOURNAL': 'GJ', 'BATCH_TITLE': 'JE-1'})
+
+    assert excinfo.value.response['error']['description2'] == 'Could not create GLBATCH record. [Support ID: abc~def]'
+
+
+def test_rejected_lookup_is_a_free_text_field(gateway):
+    # What lookup answers for a GLENTRY field that is not an object of its own.
+    error = (
+        '<error><errorno>DL02000001</errorno><description></description>'
+        '<description2>There was an error processing the request.</description2>'
+        '<correction></correction></error>'
+    )
+    gateway['lookup'] = [failure('lookup', error, ROLLED_BACK)]
+    client = make_client()
+
+    assert client.get_dimension('memo') == {'udd': False, 'key_field': None}
+
+
+def test_lookup_of_a_udd(gateway):
+    gateway['lookup'] = [operation(
+        '<result><status>success</status><function>lookup</function><data><Type Name="PROJECT">'
+        '<Fields><Field><ID>RECORDNO</ID></Field><Field><ID>PROJECTID</ID></Field></Fields>'
+        '</Type></data></result>'
+    )]
+    client = make_client()
+
+    assert client.get_dimension('project') == {'udd': True, 'key_field': 'RECORDNO'}
+
+
+def test_lookup_server_error_propagates(gateway):
+    gateway['lookup'] = [Response('<response><errormessage>Internal error</errormessage></response>', 500)]
+    client = make_client()
+
+    with pytest.raises(InternalServerError):
+        client.get_dimension('memo')
+
+
+def test_hedged_copy_is_sent_once_and_joined_on_close(monkeypatch):
+    lookups = []
+
+    def post(session, url, headers=None, data=None, timeout=None):
+        if 'getAPISession' in data:
+            return operation(LOGIN_RESULT)
+        lookups.append(data)
+        if len(lookups) == 1:
+            # The first copy stalls, then fails with an error that would normally be retried.
+            time.sleep(0.3)
+            return Response('<html>Service Unavailable</html>', 503)
+        return operation('<result><status>success</status><function>lookup</function><data/></result>')
+
+    monkeypatch.setattr(requests.Session, 'post', post)
+    client = make_client(hedge_after=0.05)
+
+    assert client.get_definition('project')['status'] == 'success'
+    client.close()
+
+    assert len(lookups) == 2
+    assert client.api_budget.counts['lookup'] == 2
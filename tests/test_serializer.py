@@ -0,0 +1,124 @@
+"""RequestSerializer must produce exactly what xmltodict.unparse did for the dict bodies."""
+import pytest
+import xmltodict
+
+from target_intacct.serializer import RequestSerializer, render
+
+SENDER_ID = 'sender'
+SENDER_PASSWORD = 'p&ss<word>'
+CONTROL_ID = '2024-01-31 12:00:00.000001'
+FUNCTION_CONTROL_ID = 'b6f2e4d0-5a7e-4c1e-9a53-2f0d3c2b8e11'
+
+
+def _dict_body(authentication, key, payload, unique=False):
+    return {
+        'request': {
+            'control': {
+                'senderid': SENDER_ID,
+                'password': SENDER_PASSWORD,
+                'controlid': CONTROL_ID,
+                'uniqueid': unique,
+                'dtdversion': 3.0,
+                'includewhitespace': False,
+            },
+            'operation': {
+                'authentication': authentication,
+                'content': {
+                    'function': {'@controlid': FUNCTION_CONTROL_ID, key: payload}
+                },
+            },
+        }
+    }
+
+
+def _assert_compatible(authentication, key, payload, unique=False):
+    serializer = RequestSerializer(SENDER_ID, SENDER_PASSWORD, authentication)
+    body = serializer.serialize(
+        key, payload, control_id=CONTROL_ID, function_control_id=FUNCTION_CONTROL_ID, unique=unique
+    )
+    assert body == xmltodict.unparse(_dict_body(authentication, key, payload, unique))
+
+
+SESSION = {'sessionid': 'abc123'}
+
+GLBATCH = {
+    'GLBATCH': {
+        'JOURNAL': 'GJ',
+        'BATCH_DATE': '01/31/2024',
+        'BATCH_TITLE': 'JE-1',
+        'ENTRIES': {
+            'GLENTRY': [
+                {
+                    'DESCRIPTION': 'Rent',
+                    'TRX_AMOUNT': '100.0',
+                    'TR_TYPE': 1,
+                    'ACCOUNTNO': '6000',
+                    'LOCATION': 'E1-L1',
+                },
+                {
+                    'DESCRIPTION': 'Rent',
+                    'TRX_AMOUNT': '100.0',
+                    'TR_TYPE': -1,
+                    'ACCOUNTNO': '1000',
+                    'LOCATION': 'E1-L1',
+                },
+            ]
+        },
+    }
+}
+
+
+def test_create_glbatch_with_glentry_list():
+    _assert_compatible(SESSION, 'create', GLBATCH)
+
+
+def test_create_glbatch_unique():
+    _assert_compatible(SESSION, 'create', GLBATCH, unique=True)
+
+
+def test_query_with_field_list():
+    payload = {
+        'object': 'GLACCOUNT',
+        'select': {'field': ['RECORDNO', 'ACCOUNTNO', 'TITLE']},
+        'filter': {'equalto': {'field': 'STATUS', 'value': 'active'}},
+        'pagesize': 1000,
+        'options': {'showprivate': True},
+    }
+    _assert_compatible(SESSION, 'query', payload)
+
+
+def test_get_api_session_login():
+    login = {
+        'login': {
+            'userid': 'user',
+            'companyid': 'company',
+            'password': 'secret',
+            'locationid': 'E1',
+        }
+    }
+    _assert_compatible(login, 'getAPISession', None)
+
+
+def test_attributes_and_text():
+    payload = {
+        'object': 'GLBATCH',
+        'keys': {'@type': 'recordno', '#text': '42'},
+        'fields': {'@all': True, 'field': ['RECORDNO', 'BATCH_TITLE']},
+    }
+    _assert_compatible(SESSION, 'read', payload)
+
+
+@pytest.mark.parametrize('value', ['A & B <C> "D"', "O'Neil & Sons", '<>&"\''])
+def test_escaping(value):
+    payload = {
+        'object': 'CUSTOMER',
+        'query': f"NAME = '{value}'",
+        'keys': {'@name': value, '#text': value},
+    }
+    _assert_compatible(SESSION, 'readByQuery', payload)
+
+
+@pytest.mark.parametrize('value', [None, True, False, 3.0, 0, '', 'text', ['a', 'b'], {'@x': '1'}])
+def test_render_matches_unparse(value):
+    expected = xmltodict.unparse({'root': {'el': value}}, full_document=False)
+    assert '<root>' + render('el', value) + '</root>' == expected
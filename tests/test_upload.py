@@ -0,0 +1,99 @@
+"""upload() with continue_on_error, against a stub client."""
+import json
+
+import pytest
+
+from target_intacct import upload
+from target_intacct.budget import ApiBudget
+from target_intacct.exceptions import DeadlineExceededError, WrongParamsError
+
+CSV = """Transaction Date,Journal Entry Id,Class,Account Number,Account Name,Posting Type,Description,Amount
+01/31/2024,JE-1,,1000,Cash,Debit,Line,10
+01/31/2024,JE-1,,2000,Revenue,Credit,Line,10
+01/31/2024,JE-2,,1000,Cash,Debit,Line,20
+01/31/2024,JE-2,,2000,Revenue,Credit,Line,20
+01/31/2024,JE-3,,1000,Cash,Debit,Line,30
+01/31/2024,JE-3,,2000,Revenue,Credit,Line,30
+01/31/2024,JE-4,,1000,Cash,Debit,Line,40
+01/31/2024,JE-4,,2000,Revenue,Credit,Line,40
+"""
+
+
+class StubClient:
+    """Posts journals in memory, raising the error queued for a BATCH_TITLE instead."""
+
+    def __init__(self, errors):
+        self.errors = errors
+        self.posted = []
+        self.api_budget = ApiBudget()
+        self.location_id = None
+
+    def set_deadline(self, deadline):
+        pass
+
+    def use_entity_session(self, location_id=None):
+        pass
+
+    def get_entity(self, *, object_type, fields):
+        return []
+
+    def post_journal(self, journal):
+        if journal['BATCH_TITLE'] in self.errors:
+            raise self.errors[journal['BATCH_TITLE']]
+        self.posted.append(journal['BATCH_TITLE'])
+
+
+@pytest.fixture
+def config(tmp_path):
+    (tmp_path / 'JournalEntries.csv').write_text(CSV)
+    return {'input_path': str(tmp_path), 'continue_on_error': True}
+
+
+def dead_letters(config):
+    with open(f"{config['input_path']}/failed_journals.jsonl") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_rejected_journals_are_dead_lettered(config):
+    client = StubClient({'JE-2': WrongParamsError('Invalid account', {'error': {'errorno': 'BL01001973'}})})
+
+    with pytest.raises(Exception, match='1 journals failed to post'):
+        upload(config, client)
+
+    assert client.posted == ['JE-1', 'JE-3', 'JE-4']
+    assert [(r['journal']['BATCH_TITLE'], r['status']) for r in dead_letters(config)] == [('JE-2', 'failed')]
+
+
+def test_run_stop_ends_the_pass(config):
+    client = StubClient({
+        'JE-1': WrongParamsError('Invalid account', {'error': {'errorno': 'BL01001973'}}),
+        'JE-2': DeadlineExceededError('The posting deadline has passed'),
+    })
+
+    with pytest.raises(DeadlineExceededError):
+        upload(config, client)
+
+    assert client.posted == []
+    assert [(r['journal']['BATCH_TITLE'], r['status']) for r in dead_letters(config)] == [
+        ('JE-1', 'failed'),
+        ('JE-2', 'not_attempted'),
+        ('JE-3', 'not_attempted'),
+        ('JE-4', 'not_attempted'),
+    ]
+
+
+def test_deadline_shorter_than_read_timeout_fails_before_any_work(config):
+    config.update(posting_deadline_seconds=120, read_timeout=300)
+    client = StubClient({})
+
+    with pytest.raises(Exception, match='posting_deadline_seconds'):
+        upload(config, client)
+
+    assert client.posted == []
+
+
+def test_deadline_shorter_than_read_timeout_is_fine_with_idempotent_creates(config):
+    config.update(posting_deadline_seconds=120, read_timeout=300, idempotent_creates=True)
+    client = StubClient({})
+
+    assert upload(config, client) == 4